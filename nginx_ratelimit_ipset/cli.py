@@ -9,6 +9,7 @@ import yaml
 
 from .log import CustomJsonFormatter
 from .plugins import plugin_factory
+from .utils.profiling import profiling
 
 logger = logging.getLogger()
 
@@ -47,6 +48,9 @@ def main():
     # Update log level from config.
     logger.setLevel(config.get("log_level", logging.INFO))
 
+    # Opt-in stage timers and signal-triggered profiling.
+    profiling.configure(config.get("profiling", {}))
+
     # Threads running the process() function of each source/sink.
     process_threads = []
 
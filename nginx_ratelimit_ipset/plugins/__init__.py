@@ -1,3 +1,4 @@
+import importlib
 import pkgutil
 from abc import ABC, abstractmethod
 from enum import Enum
@@ -50,9 +51,7 @@ def load_plugin_modules():
         if not module_name.startswith(("plugin_", "source_", "sink_")):
             continue
 
-        # See PEP 302 for details.
-        module_loader = module_finder.find_module(module_name)
-        module_loader.load_module(module_name)
+        importlib.import_module(f"{__name__}.{module_name}")
 
 
 load_plugin_modules()
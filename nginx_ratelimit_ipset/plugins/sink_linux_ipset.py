@@ -4,7 +4,8 @@ from ipaddress import ip_network
 
 import cachetools
 from nginx_ratelimit_ipset.plugins import BasePlugin, PluginType
-from nginx_ratelimit_ipset.utils import execute, ipset, types
+from nginx_ratelimit_ipset.utils import execute, history, ipset, types
+from nginx_ratelimit_ipset.utils.profiling import profiling
 
 logger = logging.getLogger(__name__)
 
@@ -26,11 +27,21 @@ class LinuxIPSetSink(BasePlugin):
         else:
             self.cache = types.nulldict()
 
+        self.history = history.OffenseHistory(
+            self.config.get("offense_history_size", 100_000),
+            self.config.get("offense_history_ttl_seconds", 2_592_000),
+            self.config.get("offense_history_file_path"),
+        )
+
     def process(self, q):
         for item in iter(q.get, None):
+            profiling.checkpoint()
             logger.debug("got item", extra={"item": item})
 
-            if item["addr"] in self.cache:
+            with profiling.stage("linux_ipset.dedup"):
+                cached = item["addr"] in self.cache
+
+            if cached:
                 logger.debug(
                     "item found in cache; ignoring",
                     extra={"item": item},
@@ -38,7 +49,8 @@ class LinuxIPSetSink(BasePlugin):
                 continue
 
             try:
-                self.handle_item(item)
+                with profiling.stage("linux_ipset.handle_item"):
+                    self.handle_item(item)
                 self.cache[item["addr"]] = item
             except Exception as e:
                 logger.error("error", extra={"error": e})
@@ -61,6 +73,9 @@ class LinuxIPSetSink(BasePlugin):
             ipset_list_info["header"]["family"]
         ]
 
+        # The IP set's default entry timeout; 0 if entries never expire.
+        self.ipset_default_timeout = ipset_list_info["header"].get("timeout", 0)
+
     def handle_item(self, item):
         # Parse the item address as an IP address.
         addr = ip_network(item["addr"], strict=False)
@@ -97,12 +112,23 @@ class LinuxIPSetSink(BasePlugin):
             item["addr"],
         ]
 
-        cfgkey = "entry_default_timeout_seconds"
-        if cfgkey in self.config:
+        # Not a new offense if the address is still banned.
+        offenses = self.history.offenses(item["addr"])
+
+        timeout = None
+        cfgkey = "entry_timeout_schedule_seconds"
+        if self.config.get(cfgkey):
+            # Escalate with each offense; stay at the last step.
+            schedule = self.config[cfgkey]
+            timeout = schedule[min(offenses, len(schedule)) - 1]
+        elif "entry_default_timeout_seconds" in self.config:
+            timeout = self.config["entry_default_timeout_seconds"]
+
+        if timeout is not None:
             cmd.extend(
                 [
                     "timeout",
-                    str(self.config[cfgkey]),
+                    str(timeout),
                 ]
             )
 
@@ -115,7 +141,8 @@ class LinuxIPSetSink(BasePlugin):
                     datetime.datetime.utcnow()
                     .replace(tzinfo=datetime.timezone.utc)
                     .isoformat()
-                )
+                ),
+                "offenses": offenses,
             }
 
             # Format: key1=val1; key2=val2; ...
@@ -133,7 +160,11 @@ class LinuxIPSetSink(BasePlugin):
             )
             return
 
-        execute.simple(cmd)
+        with profiling.stage("linux_ipset.execute"):
+            execute.simple(cmd)
+        if timeout is None:
+            timeout = self.ipset_default_timeout
+        self.history.record(item["addr"], offenses, timeout)
         logger.info(
             "ipset entry added successfully",
             extra={
@@ -141,8 +172,3 @@ class LinuxIPSetSink(BasePlugin):
                 "argv": cmd,
             },
         )
-
-
-# Raise exception early if list command fails.
-# FIXME actually don't. only raise if plugin is actually used
-execute.simple([LinuxIPSetSink.ipset_cmd, "list"])
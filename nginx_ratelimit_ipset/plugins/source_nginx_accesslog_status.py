@@ -0,0 +1,149 @@
+import logging
+
+from nginx_ratelimit_ipset.plugins.source_nginx_ratelimit import NginxRatelimitSource
+from nginx_ratelimit_ipset.utils import nginx
+from nginx_ratelimit_ipset.utils.profiling import profiling
+
+logger = logging.getLogger(__name__)
+
+
+class NginxAccessLogStatusSource(NginxRatelimitSource):
+    """
+    Follow the Nginx access log and produce events for responses with matching
+    status codes, and optionally matching hosts and paths.
+
+    Access logs are high-volume, so lines are rejected on the bytes level: a
+    substring scan for the wanted status codes, followed by a field split that
+    stops after the last field of interest.
+    """
+
+    plugin_name = "NGINX_ACCESSLOG_STATUS"
+    log_file_path_key = "access_log_file_path"
+
+    def configure(self, config):
+        super().configure(config)
+
+        self.log_format = nginx.LogFormat(
+            self.config.get("log_format", nginx.COMBINED_LOG_FORMAT)
+        )
+        names = self.log_format.index
+
+        statuses = [str(s) for s in self.config.get("statuses", [429, 503])]
+        self.statuses = {s.encode("utf-8") for s in statuses}
+        self.hosts = {h.encode("utf-8") for h in self.config.get("hosts", [])}
+        self.path_prefixes = tuple(
+            p.encode("utf-8") for p in self.config.get("path_prefixes", [])
+        )
+
+        addr_var = self.config.get("addr_variable", "remote_addr")
+        for var in (addr_var, "status"):
+            if var not in names:
+                raise ValueError(f"log_format has no ${var}")
+
+        self.addr_index = names[addr_var]
+        self.status_index = names["status"]
+        self.status_needles = self.log_format.needles("status", statuses)
+
+        wanted = [self.addr_index, self.status_index]
+
+        self.host_index = None
+        if self.hosts:
+            if "host" not in names:
+                raise ValueError("host matching requires $host in log_format")
+            self.host_index = names["host"]
+            wanted.append(self.host_index)
+
+        # Prefer a variable holding the bare URI; fall back to the request line.
+        self.path_index = None
+        self.path_from_request = False
+        if self.path_prefixes:
+            for var in ("request_uri", "uri", "request"):
+                if var in names:
+                    self.path_index = names[var]
+                    self.path_from_request = var == "request"
+                    break
+            else:
+                raise ValueError(
+                    "path matching requires $request_uri, $uri or $request in "
+                    "log_format"
+                )
+            wanted.append(self.path_index)
+
+        # Only split lines up to the last field of interest.
+        self.field_count = max(wanted) + 1
+
+    def event_matches_config(self, event):
+        return not self.addr_is_ignored(event["addr"])
+
+    def filter_lines(self, lines):
+        """
+        Split raw access log lines and return the events that match the
+        configuration.
+        """
+        events = []
+        with profiling.stage("nginx_accesslog_status.split"):
+            candidates = []
+            for line in lines:
+                # Cheap reject; most lines have a non-matching status.
+                for needle in self.status_needles:
+                    if needle in line:
+                        break
+                else:
+                    continue
+
+                fields = self.log_format.split(line.rstrip(b"\r\n"), self.field_count)
+                if fields is None or fields[self.status_index] not in self.statuses:
+                    continue
+
+                if (
+                    self.host_index is not None
+                    and fields[self.host_index] not in self.hosts
+                ):
+                    continue
+
+                path = None
+                if self.path_index is not None:
+                    path = fields[self.path_index]
+                    if self.path_from_request:
+                        # Request line: METHOD PATH PROTOCOL.
+                        tokens = path.split(b" ")
+                        path = tokens[1] if len(tokens) > 1 else b""
+                    if not path.startswith(self.path_prefixes):
+                        continue
+
+                candidates.append((fields, path))
+
+        for fields, path in candidates:
+            try:
+                event = {
+                    "addr": fields[self.addr_index].decode("utf-8"),
+                    "status": int(fields[self.status_index]),
+                    "host": fields[self.host_index].decode("utf-8")
+                    if self.host_index is not None
+                    else None,
+                    "path": path.decode("utf-8", "replace")
+                    if path is not None
+                    else None,
+                }
+
+                with profiling.stage("nginx_accesslog_status.match"):
+                    matches = self.event_matches_config(event)
+            except ValueError as e:
+                # E.g. "unix:" from a unix socket listener, or "-" or a list of
+                # addresses from $http_x_forwarded_for.
+                logger.debug(
+                    "invalid client address; ignoring",
+                    extra={"fields": fields, "exception": e},
+                )
+                continue
+
+            if not matches:
+                logger.debug(
+                    "event does not match config",
+                    extra={"event": event, "config": self.config},
+                )
+                continue
+
+            events.append(event)
+
+        return events
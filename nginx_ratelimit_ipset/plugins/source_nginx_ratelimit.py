@@ -1,14 +1,20 @@
+import collections
+import itertools
 import logging
+import multiprocessing
 import queue
 import signal
 import threading
 import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from enum import Enum
 from ipaddress import ip_network
 
 import cachetools
-from nginx_ratelimit_ipset.plugins import BasePlugin, PluginType
+from nginx_ratelimit_ipset.plugins import BasePlugin, PluginType, plugin_factory
 from nginx_ratelimit_ipset.utils import nginx, tail, types
+from nginx_ratelimit_ipset.utils.profiling import profiling
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +27,7 @@ class StdStreamType(Enum):
 class NginxRatelimitSource(BasePlugin):
     plugin_type = PluginType["SOURCE"]
     plugin_name = "NGINX_RATELIMIT"
+    log_file_path_key = "error_log_file_path"
 
     def configure(self, config):
         self.config = config
@@ -53,7 +60,14 @@ class NginxRatelimitSource(BasePlugin):
         if rlevent["dry_run"] and self.config["ratelimit_ignore_if_dry_run"]:
             return False
 
-        addr = ip_network(rlevent["addr"], strict=False)
+        with profiling.stage("nginx_ratelimit.ignore_cidrs"):
+            if self.addr_is_ignored(rlevent["addr"]):
+                return False
+
+        return True
+
+    def addr_is_ignored(self, addrstr):
+        addr = ip_network(addrstr, strict=False)
         for cidrstr in self.config.get("ignore_cidrs", ["127.0.0.0/8", "::1"]):
             cidr = ip_network(cidrstr, strict=False)
             if addr.overlaps(cidr):
@@ -64,28 +78,67 @@ class NginxRatelimitSource(BasePlugin):
                         "matching_ignore_cidr": cidr,
                     },
                 )
-                return False
-
-        return True
+                return True
 
-    def qstdout_handler(self, q, qs):
-        for line in iter(q.get, None):
-            s = line.decode("utf-8").strip()
+        return False
 
+    def filter_lines(self, lines):
+        """
+        Parse raw error log lines and return the events that match the
+        configuration.
+        """
+        events = []
+        for line in lines:
             try:
-                rlevent = nginx.parse_ratelimit_line(s)
+                with profiling.stage("nginx_ratelimit.parse"):
+                    s = line.decode("utf-8").strip()
+                    rlevent = nginx.parse_ratelimit_line(s)
             except nginx.UnhandledEventException as e:
                 logger.debug("unhandled event", extra={"exception": e})
                 continue
 
-            if not self.event_matches_config(rlevent):
+            with profiling.stage("nginx_ratelimit.match"):
+                matches = self.event_matches_config(rlevent)
+
+            if not matches:
                 logger.debug(
                     "event does not match config",
                     extra={"event": rlevent, "config": self.config},
                 )
                 continue
 
-            if rlevent["addr"] not in self.cache:
+            events.append(rlevent)
+
+        return events
+
+    def filter_batch(self, lines):
+        """
+        Like filter_lines(), but if the batch fails, filter its lines one by
+        one, and skip the lines that fail.
+        """
+        try:
+            return self.filter_lines(lines)
+        except Exception:
+            pass
+
+        events = []
+        for line in lines:
+            try:
+                events.extend(self.filter_lines([line]))
+            except Exception as e:
+                logger.error(
+                    "error filtering line; ignoring",
+                    extra={"line": line, "exception": e},
+                )
+
+        return events
+
+    def dispatch(self, events, qs):
+        for rlevent in events:
+            with profiling.stage("nginx_ratelimit.dedup"):
+                cached = rlevent["addr"] in self.cache
+
+            if not cached:
                 # Put event into all sink queues.
                 for q in qs:
                     q.put(rlevent)
@@ -96,6 +149,134 @@ class NginxRatelimitSource(BasePlugin):
                     extra={"event": rlevent},
                 )
 
+    def qstdout_handler(self, q, qs):
+        if self.config.get("parse_workers", 0) > 0:
+            self.parallel_qstdout_handler(q, qs)
+            return
+
+        for lines in self.batches(q):
+            profiling.checkpoint()
+            self.dispatch(self.filter_batch(lines), qs)
+
+    def batches(self, q):
+        """
+        Read lines from the queue and yield them in lists of at most
+        parse_batch_size lines. A batch is yielded as soon as the queue runs
+        dry, so a quiet log is not delayed.
+        """
+        batch_size = self.config.get("parse_batch_size", 500)
+        for line in iter(q.get, None):
+            lines = [line]
+            done = False
+            while len(lines) < batch_size:
+                try:
+                    line = q.get_nowait()
+                except queue.Empty:
+                    break
+                if line is None:
+                    done = True
+                    break
+                lines.append(line)
+
+            yield lines
+
+            if done:
+                return
+
+    def parse_executor(self, workers):
+        ctx = multiprocessing.get_context(
+            self.config.get("parse_start_method", "forkserver")
+        )
+
+        logger.debug("starting parse workers", extra={"parse_workers": workers})
+        return ProcessPoolExecutor(
+            workers,
+            mp_context=ctx,
+            initializer=_init_parse_worker,
+            initargs=(self.plugin_name, self.config, profiling.enabled),
+        )
+
+    def parallel_qstdout_handler(self, q, qs):
+        """
+        Hand line batches to a pool of worker processes that parse and filter
+        them. Only matching events are sent back for de-duplication and
+        dispatch, which happens in this thread.
+
+        Each batch is sent as a single bytes object. Stage timers of the
+        workers are sent back with the events, and merged into this process'
+        timers.
+
+        If a worker dies, the batches in flight are filtered in this thread,
+        and the pool is restarted. If the restarted pool dies before returning
+        any result, fall back to filtering in this thread.
+        """
+        workers = self.config["parse_workers"]
+        max_inflight = workers * 2
+        pending = collections.deque()  # (future, lines), in submission order.
+        self.parse_pool = self.parse_executor(workers)
+        healthy = False  # Whether the current pool has returned a result.
+
+        # A trailing None marks the end of the lines; drain all pending batches.
+        for lines in itertools.chain(self.batches(q), [None]):
+            done = lines is None
+            if not done:
+                if self.parse_pool is None:
+                    profiling.checkpoint()
+                    self.dispatch(self.filter_batch(lines), qs)
+                    continue
+
+                future = self.parse_pool.submit(_parse_batch, b"".join(lines))
+                pending.append((future, lines))
+
+            # Handle results in order. Wait for the oldest batch when too many
+            # are in flight, or when no more lines are waiting, so that a quiet
+            # log is not delayed.
+            while pending and (
+                done
+                or len(pending) >= max_inflight
+                or pending[0][0].done()
+                or q.empty()
+            ):
+                future, batch = pending.popleft()
+                try:
+                    events, stages = future.result()
+                except BrokenProcessPool as e:
+                    lost = [batch] + [batch for _, batch in pending]
+                    pending.clear()
+                    self.parse_pool.shutdown(wait=False)
+
+                    if healthy:
+                        logger.error(
+                            "parse worker died; restarting parse workers",
+                            extra={"exception": e, "lost_batches": len(lost)},
+                        )
+                        self.parse_pool = self.parse_executor(workers)
+                        healthy = False
+                    else:
+                        logger.error(
+                            "parse workers failing; falling back to serial parsing",
+                            extra={"exception": e, "lost_batches": len(lost)},
+                        )
+                        self.parse_pool = None
+
+                    for batch in lost:
+                        self.dispatch(self.filter_batch(batch), qs)
+                    break
+                except Exception as e:
+                    logger.error(
+                        "error in parse worker; filtering batch in-thread",
+                        extra={"exception": e},
+                    )
+                    events, stages = self.filter_batch(batch), {}
+
+                healthy = True
+                profiling.checkpoint()
+                profiling.merge(stages)
+                self.dispatch(events, qs)
+
+        if self.parse_pool is not None:
+            self.parse_pool.shutdown()
+
     def qstderr_handler(self, q):
         for line in iter(q.get, None):
             s = line.decode("utf-8").strip()
@@ -116,7 +297,7 @@ class NginxRatelimitSource(BasePlugin):
             ]
             [t.start() for t in threads]
 
-            rc = tail.tail(self.config["error_log_file_path"], qstdout, qstderr)
+            rc = tail.tail(self.config[self.log_file_path_key], qstdout, qstderr)
 
             # Close the queues.
             qstdout.put(None)
@@ -133,3 +314,27 @@ class NginxRatelimitSource(BasePlugin):
     def process(self, qs):
         self.qs = qs
         self.tail_with_retry()
+
+
+# Source instance of a parse worker process.
+_worker_source = None
+
+
+def _init_parse_worker(plugin_name, config, profile_stages):
+    global _worker_source
+    _worker_source = plugin_factory(plugin_name)
+    _worker_source.configure(config)
+
+    # Leave Ctrl-C, which the terminal sends to the whole process group, to
+    # the main process; it shuts down the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Forked workers inherit the parent's timers; start from scratch.
+    profiling.enabled = profile_stages
+    profiling.stages = {}
+    profiling.session = None
+
+
+def _parse_batch(batch):
+    events = _worker_source.filter_batch(batch.splitlines())
+    return events, profiling.drain()
@@ -0,0 +1,149 @@
+import logging
+import os
+import time
+
+import cachetools
+
+logger = logging.getLogger(__name__)
+
+
+class OffenseHistory:
+    """
+    Per-address offense counts, bounded in memory by LRU eviction, and
+    optionally persisted to an append-only log file.
+
+    Along with the count, the time and timeout of the last ban are kept, so
+    that events for an address that is still banned do not count as new
+    offenses. A timeout of 0 means the ban never expires, as in ipset. An entry
+    is forgotten ttl seconds after its last ban has expired, so that the count
+    of an address that is still banned is never reset; entries of permanent
+    bans are only discarded by LRU eviction.
+
+    Each ban appends a line to the log:
+
+      <addr> <count> <last_ban_epoch> <last_ban_timeout>
+
+    On load, the last line for each address wins. The log is compacted (live
+    entries rewritten to a new file, which replaces the old one) on load, and
+    whenever it holds several times more lines than there are entries.
+    """
+
+    compact_ratio = 4
+    compact_min_records = 1000
+
+    def __init__(self, maxsize, ttl, path=None):
+        self.entries = cachetools.LRUCache(maxsize)
+        self.ttl = ttl
+        self.path = path
+        self.log = None
+        self.log_records = 0
+
+        if self.path is not None:
+            self.path = os.path.expanduser(self.path)
+            self.load()
+            self.compact()
+
+    def load(self):
+        try:
+            f = open(self.path, "r")
+        except FileNotFoundError:
+            return
+
+        with f:
+            for line in f:
+                try:
+                    addr, count, ts, timeout = line.split()
+                    self.entries[addr] = (int(count), int(ts), int(timeout))
+                except ValueError:
+                    # Probably a partial line, written before a crash.
+                    logger.debug("ignoring invalid history line", extra={"line": line})
+
+        logger.debug(
+            "offense history loaded",
+            extra={"path": self.path, "entry_count": len(self.entries)},
+        )
+
+    def count(self, addr, now=None):
+        """
+        Return the number of unexpired offenses recorded for the address.
+        """
+        entry = self.entries.get(addr)
+        if entry is None:
+            return 0
+
+        if now is None:
+            now = time.time()
+
+        if self.forgotten(entry, now):
+            return 0
+
+        return entry[0]
+
+    def forgotten(self, entry, now):
+        _, ts, timeout = entry
+        if timeout == 0:
+            return False
+
+        return now - (ts + timeout) > self.ttl
+
+    def offenses(self, addr, now=None):
+        """
+        Return the offense count of a ban of the address now: the recorded count
+        if its last ban has not expired yet, otherwise one more.
+        """
+        if now is None:
+            now = time.time()
+
+        count = self.count(addr, now)
+        if count:
+            _, ts, timeout = self.entries[addr]
+            if timeout == 0 or now - ts < timeout:
+                return count
+
+        return count + 1
+
+    def record(self, addr, count, timeout, now=None):
+        """
+        Record a ban of the address, with the given offense count and timeout.
+        """
+        now = int(time.time() if now is None else now)
+        self.entries[addr] = (count, now, timeout)
+
+        if self.log is not None:
+            self.log.write(f"{addr} {count} {now} {timeout}\n")
+            self.log.flush()
+            self.log_records += 1
+
+            threshold = max(len(self.entries), self.compact_min_records)
+            if self.log_records > self.compact_ratio * threshold:
+                self.compact()
+
+    def compact(self):
+        if self.log is not None:
+            self.log.close()
+
+        now = time.time()
+        live = [
+            (addr, count, ts, timeout)
+            for addr, (count, ts, timeout) in list(self.entries.items())
+            if not self.forgotten((count, ts, timeout), now)
+        ]
+
+        # Oldest first, so that a reload restores the LRU order approximately.
+        live.sort(key=lambda entry: entry[2])
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            for addr, count, ts, timeout in live:
+                f.write(f"{addr} {count} {ts} {timeout}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+        self.log = open(self.path, "a")
+        self.log_records = len(live)
+
+        logger.debug(
+            "offense history compacted",
+            extra={"path": self.path, "entry_count": len(live)},
+        )
@@ -0,0 +1,371 @@
+import cProfile
+import logging
+import os.path
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+# Python 3.12 and later implement cProfile on top of sys.monitoring, which hooks
+# all threads of the interpreter, and allows only one active profiler.
+PROCESS_WIDE_PROFILER = sys.version_info >= (3, 12)
+
+
+class _NullStage:
+    """
+    A no-op context manager, handed out when profiling is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_stage = _NullStage()
+
+
+class Stage:
+    """
+    Accumulate call count, total and max elapsed time for a named stage, using
+    the monotonic performance counter.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+        # Per-thread start times, since stages are shared between threads.
+        self.local = threading.local()
+
+    def __enter__(self):
+        self.local.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.local.start
+        with self.lock:
+            self.count += 1
+            self.total += elapsed
+            if elapsed > self.max:
+                self.max = elapsed
+        return False
+
+    def sample(self, reset=False):
+        """
+        Return a snapshot of the stage counters, optionally resetting them.
+        """
+        with self.lock:
+            snapshot = {
+                "count": self.count,
+                "total_seconds": round(self.total, 6),
+                "mean_seconds": round(self.total / self.count, 9)
+                if self.count
+                else 0.0,
+                "max_seconds": round(self.max, 6),
+            }
+            if reset:
+                self.count = 0
+                self.total = 0.0
+                self.max = 0.0
+        return snapshot
+
+    def drain(self):
+        """
+        Return the raw (count, total, max) counters and reset them.
+        """
+        with self.lock:
+            counters = (self.count, self.total, self.max)
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+        return counters
+
+    def merge(self, counters):
+        """
+        Add raw counters, as returned by drain(), to this stage.
+        """
+        count, total, max_ = counters
+        with self.lock:
+            self.count += count
+            self.total += total
+            if max_ > self.max:
+                self.max = max_
+
+
+class ProfileSession:
+    """
+    A time-limited cProfile and tracemalloc session.
+
+    Before Python 3.12, cProfile only hooks the thread that enables it, so each
+    instrumented thread attaches its own profiler on its next checkpoint() while
+    the session is active, and detaches on its first checkpoint() after the
+    session has been stopped. The per-thread results are merged into a single
+    pstats file when the session is dumped. From Python 3.12, a single profiler
+    covers all threads, and checkpoint() does nothing.
+    """
+
+    def __init__(self, output_dir, top_allocations):
+        self.output_dir = output_dir
+        self.top_allocations = top_allocations
+        self.active = threading.Event()
+        self.lock = threading.Lock()
+        self.attached = {}  # Thread ident -> cProfile.Profile.
+        self.finished = []
+        self.profiler = None  # Process-wide profiler.
+        self.dumped = False
+        self.started_tracemalloc = False
+        self.started_at = time.strftime("%Y%m%dT%H%M%S")
+
+    def checkpoint(self):
+        if PROCESS_WIDE_PROFILER:
+            return
+
+        ident = threading.get_ident()
+        if self.active.is_set():
+            if ident not in self.attached:
+                profiler = cProfile.Profile()
+                with self.lock:
+                    self.attached[ident] = profiler
+                profiler.enable()
+        elif ident in self.attached:
+            with self.lock:
+                profiler = self.attached.pop(ident)
+            profiler.disable()
+            with self.lock:
+                self.finished.append(profiler)
+
+    def start(self):
+        # Leave tracing alone if someone else started it, e.g. through
+        # PYTHONTRACEMALLOC.
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        if PROCESS_WIDE_PROFILER:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.active.set()
+
+    def stop(self):
+        self.active.clear()
+        if self.profiler is not None:
+            self.profiler.disable()
+
+    def stop_tracemalloc(self):
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+
+    def done(self):
+        """
+        Return whether the session has been dumped, and all threads have
+        detached their profilers.
+        """
+        with self.lock:
+            return self.dumped and not self.attached
+
+    def dump(self):
+        """
+        Write the merged pstats file and the tracemalloc top allocations.
+        Return the written file paths.
+        """
+        paths = []
+        prefix = os.path.join(
+            os.path.expanduser(self.output_dir),
+            f"nginx-ratelimit-ipset-{self.started_at}-{os.getpid()}",
+        )
+
+        # Threads that have not passed a checkpoint since the session was
+        # stopped are idle, e.g. blocked on an empty queue. Their profilers are
+        # included as well; pstats.Stats() disables them, and the threads drop
+        # their profiling hooks on their next checkpoint.
+        with self.lock:
+            profilers = self.finished + list(self.attached.values())
+        if self.profiler is not None:
+            profilers.append(self.profiler)
+
+        if profilers:
+            stats = pstats.Stats(profilers[0])
+            for profiler in profilers[1:]:
+                stats.add(profiler)
+            path = f"{prefix}.pstats"
+            stats.dump_stats(path)
+            paths.append(path)
+
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            self.stop_tracemalloc()
+            path = f"{prefix}.tracemalloc.txt"
+            with open(path, "w") as f:
+                for stat in snapshot.statistics("lineno")[: self.top_allocations]:
+                    f.write(f"{stat}\n")
+            paths.append(path)
+
+        with self.lock:
+            self.dumped = True
+
+        return paths
+
+
+class Profiling:
+    """
+    Opt-in instrumentation: named stage timers, periodic reporting of the timer
+    samples, and a signal-triggered profiling session.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        self.session = None
+        self.session_lock = threading.Lock()
+
+    def configure(self, config):
+        self.config = config
+        self.enabled = config.get("enabled", False)
+        if not self.enabled:
+            return
+
+        signame = config.get("signal", "SIGUSR1")
+        signal.signal(signal.Signals[signame], self.signal_handler)
+
+        interval = config.get("report_interval_seconds", 60.0)
+        if interval > 0:
+            threading.Thread(
+                target=self.report_loop, args=(interval,), daemon=True
+            ).start()
+
+        logger.info("profiling enabled", extra={"signal": signame})
+
+    def stage(self, name):
+        """
+        Return a context manager timing the named stage. Cheap no-op when
+        profiling is disabled.
+        """
+        if not self.enabled:
+            return _null_stage
+
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages.setdefault(name, Stage(name))
+        return stage
+
+    def checkpoint(self):
+        """
+        Attach or detach the calling thread's profiler. Call this once per
+        processed item from each instrumented loop.
+        """
+        session = self.session
+        if session is None:
+            return
+
+        try:
+            session.checkpoint()
+        except Exception as e:
+            logger.error("profiling checkpoint failed", extra={"exception": e})
+
+        if session.done():
+            self.release(session)
+
+    def release(self, session):
+        with self.session_lock:
+            if self.session is session:
+                self.session = None
+
+    def drain(self):
+        """
+        Return the raw counters of all stages, and reset them.
+        """
+        return {name: stage.drain() for name, stage in list(self.stages.items())}
+
+    def merge(self, counters):
+        """
+        Add raw stage counters, e.g. from another process, to the stages.
+        """
+        for name, stage_counters in counters.items():
+            stage = self.stage(name)
+            if stage is not _null_stage:
+                stage.merge(stage_counters)
+
+    def sample(self, reset=False):
+        return {
+            name: stage.sample(reset=reset)
+            for name, stage in sorted(self.stages.items())
+        }
+
+    def report_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            logger.info("stage timers", extra={"stages": self.sample(reset=True)})
+
+    def signal_handler(self, signum, frame):
+        # Toggle: start a session, or cut a running session short.
+        with self.session_lock:
+            session = self.session
+        if session is not None and session.active.is_set():
+            session.stop()
+        else:
+            threading.Thread(target=self.run_session, daemon=True).start()
+
+    def run_session(self):
+        duration = self.config.get("duration_seconds", 30.0)
+        session = ProfileSession(
+            self.config.get("output_dir", "/tmp"),
+            self.config.get("top_allocations", 25),
+        )
+        with self.session_lock:
+            if self.session is not None:
+                logger.info("previous profiling session not finished; ignoring")
+                return
+            self.session = session
+
+        logger.info("profiling started", extra={"duration_seconds": duration})
+        try:
+            session.start()
+        except Exception as e:
+            # E.g. another profiling tool being active.
+            logger.error("error starting profiler", extra={"exception": e})
+            session.stop()
+            session.stop_tracemalloc()
+            self.release(session)
+            return
+
+        deadline = time.monotonic() + duration
+        while session.active.is_set() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        session.stop()
+
+        # Give busy threads a moment to pass a checkpoint and detach.
+        time.sleep(self.config.get("detach_grace_seconds", 1.0))
+
+        try:
+            paths = session.dump()
+        except Exception as e:
+            logger.error("error writing profile", extra={"exception": e})
+            session.stop_tracemalloc()
+            paths = []
+            with session.lock:
+                session.dumped = True
+
+        # Idle threads release the session on their next checkpoint.
+        if session.done():
+            self.release(session)
+
+        if not paths:
+            return
+
+        logger.info(
+            "profiling stopped",
+            extra={"paths": paths, "stages": self.sample()},
+        )
+
+
+# Process-wide instance; configured from the global "profiling" section.
+profiling = Profiling()
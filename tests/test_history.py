@@ -0,0 +1,110 @@
+import time
+
+from nginx_ratelimit_ipset.utils.history import OffenseHistory
+
+
+def test_offense_count():
+    h = OffenseHistory(10, 86400)
+    assert h.count("10.0.0.1") == 0
+    assert h.offenses("10.0.0.1", now=1000) == 1
+    h.record("10.0.0.1", 1, 3600, now=1000)
+    assert h.count("10.0.0.1", now=2000) == 1
+
+    # After the ban has expired.
+    assert h.offenses("10.0.0.1", now=1000 + 3600) == 2
+    h.record("10.0.0.1", 2, 21600, now=1000 + 3600)
+    assert h.count("10.0.0.1", now=1000 + 3600) == 2
+
+
+def test_offense_while_banned():
+    h = OffenseHistory(10, 86400)
+    h.record("10.0.0.1", 1, 3600, now=1000)
+
+    # Re-added while still banned; not a new offense, and the ban is renewed.
+    assert h.offenses("10.0.0.1", now=1060) == 1
+    h.record("10.0.0.1", 1, 3600, now=1060)
+    assert h.offenses("10.0.0.1", now=1000 + 3600) == 1
+    assert h.offenses("10.0.0.1", now=1060 + 3600) == 2
+
+
+def test_offense_permanent_ban():
+    h = OffenseHistory(10, 86400)
+    h.record("10.0.0.1", 1, 0, now=1000)
+    assert h.offenses("10.0.0.1", now=1000 + 80000) == 1
+
+
+def test_offense_expiry():
+    h = OffenseHistory(10, 3600)
+    h.record("10.0.0.1", 1, 60, now=1000)
+    assert h.count("10.0.0.1", now=1000 + 60 + 3600) == 1
+    assert h.count("10.0.0.1", now=1000 + 60 + 3601) == 0
+    assert h.offenses("10.0.0.1", now=1000 + 60 + 3601) == 1
+
+
+def test_offense_expiry_after_ban():
+    # The ttl starts when the ban expires, not when it starts.
+    h = OffenseHistory(10, 86400)
+    h.record("10.0.0.1", 4, 604800, now=0)
+    assert h.offenses("10.0.0.1", now=100000) == 4
+    assert h.offenses("10.0.0.1", now=604800 + 86400) == 5
+    assert h.offenses("10.0.0.1", now=604800 + 86401) == 1
+
+    # Permanent bans are never forgotten.
+    h.record("10.0.0.2", 2, 0, now=0)
+    assert h.offenses("10.0.0.2", now=10**9) == 2
+
+
+def test_offense_history_compaction_keeps_banned(tmp_path):
+    path = tmp_path / "history.log"
+    h = OffenseHistory(10, 60, str(path))
+    now = time.time()
+    h.record("10.0.0.1", 4, 604800, now=now - 86400)
+    h.record("10.0.0.2", 1, 0, now=now - 86400)
+    h.record("10.0.0.3", 1, 60, now=now - 86400)
+    h.compact()
+
+    assert [line.split()[0] for line in path.read_text().splitlines()] == [
+        "10.0.0.1",
+        "10.0.0.2",
+    ]
+
+
+def test_offense_history_persisted(tmp_path):
+    path = tmp_path / "history.log"
+    h = OffenseHistory(10, 3600, str(path))
+    h.record("10.0.0.1", 1, 60)
+    h.record("10.0.0.1", 2, 60)
+    h.record("10.0.0.2", 1, 60)
+    h.log.close()
+
+    # Simulate a partial line from a crash.
+    with open(path, "a") as f:
+        f.write("10.0.0.3 1")
+
+    h = OffenseHistory(10, 3600, str(path))
+    assert h.count("10.0.0.1") == 2
+    assert h.count("10.0.0.2") == 1
+    assert h.count("10.0.0.3") == 0
+
+    # Compacted on load: one line per address.
+    assert len(path.read_text().splitlines()) == 2
+
+
+def test_offense_history_compaction(tmp_path):
+    path = tmp_path / "history.log"
+    h = OffenseHistory(10, 3600, str(path))
+    h.compact_min_records = 2
+
+    # One entry; compacted when the log exceeds 4 * max(1, 2) = 8 lines.
+    for i in range(8):
+        h.record("10.0.0.1", i + 1, 60)
+    assert len(path.read_text().splitlines()) == 8
+
+    h.record("10.0.0.1", 9, 60)
+    assert path.read_text().split() == [
+        "10.0.0.1",
+        "9",
+        str(h.entries["10.0.0.1"][1]),
+        "60",
+    ]
+    assert h.count("10.0.0.1") == 9
@@ -0,0 +1,50 @@
+import pytest
+
+from nginx_ratelimit_ipset.utils import nginx
+
+LINE = (
+    b'10.0.0.1 - - [01/Jan/2022:00:00:00 +0000] "GET /api/x HTTP/1.1" 429 162 '
+    b'"-" "curl/7.81.0"'
+)
+
+
+def test_log_format_split():
+    fmt = nginx.LogFormat(nginx.COMBINED_LOG_FORMAT)
+    fields = fmt.split(LINE)
+    assert fields[fmt.index["remote_addr"]] == b"10.0.0.1"
+    assert fields[fmt.index["request"]] == b"GET /api/x HTTP/1.1"
+    assert fields[fmt.index["status"]] == b"429"
+    assert fields[fmt.index["http_user_agent"]] == b"curl/7.81.0"
+
+
+def test_log_format_split_partial():
+    fmt = nginx.LogFormat(nginx.COMBINED_LOG_FORMAT)
+    fields = fmt.split(LINE, fmt.index["status"] + 1)
+    assert fields[-1] == b"429"
+    assert len(fields) == fmt.index["status"] + 1
+
+
+def test_log_format_split_mismatch():
+    fmt = nginx.LogFormat(nginx.COMBINED_LOG_FORMAT)
+    assert fmt.split(b"garbage") is None
+
+
+def test_log_format_needles():
+    fmt = nginx.LogFormat(nginx.COMBINED_LOG_FORMAT)
+    assert fmt.needles("status", ["429"]) == [b'" 429 ']
+
+
+def test_log_format_missing_separator():
+    with pytest.raises(ValueError):
+        nginx.LogFormat("$remote_addr$status")
+
+
+def test_log_format_braces():
+    fmt = nginx.LogFormat('${remote_addr} "$request" ${status}x$body_bytes_sent')
+    assert fmt.names == ["remote_addr", "request", "status", "body_bytes_sent"]
+    assert fmt.split(b'10.0.0.1 "GET / HTTP/1.1" 429x162') == [
+        b"10.0.0.1",
+        b"GET / HTTP/1.1",
+        b"429",
+        b"162",
+    ]
@@ -0,0 +1,132 @@
+import queue
+import sys
+import threading
+import tracemalloc
+
+from nginx_ratelimit_ipset.utils import profiling as profiling_module
+from nginx_ratelimit_ipset.utils.profiling import Profiling, Stage
+
+
+def test_stage_sample_reset():
+    stage = Stage("x")
+    with stage:
+        pass
+    with stage:
+        pass
+
+    sample = stage.sample()
+    assert sample["count"] == 2
+    assert sample["max_seconds"] >= 0.0
+
+    assert stage.sample(reset=True)["count"] == 2
+    assert stage.sample() == {
+        "count": 0,
+        "total_seconds": 0.0,
+        "mean_seconds": 0.0,
+        "max_seconds": 0.0,
+    }
+
+
+def test_stage_disabled():
+    p = Profiling()
+    with p.stage("x"):
+        pass
+    assert p.stages == {}
+    assert p.sample() == {}
+
+
+def test_stage_merge():
+    p = Profiling()
+    p.enabled = True
+    p.merge({"x": (3, 0.5, 0.25)})
+    p.merge({"x": (1, 0.1, 0.1)})
+    assert p.sample()["x"]["count"] == 4
+    assert p.sample()["x"]["max_seconds"] == 0.25
+
+
+def test_run_session(tmp_path):
+    p = Profiling()
+    p.enabled = True
+    p.config = {
+        "output_dir": str(tmp_path),
+        "duration_seconds": 0.3,
+        "detach_grace_seconds": 0.2,
+    }
+
+    stop = threading.Event()
+    started = threading.Event()
+    profile_hooks = {}
+
+    def busy(name):
+        while not stop.is_set():
+            p.checkpoint()
+            with p.stage(name):
+                sum(range(100))
+        p.checkpoint()
+        profile_hooks[name] = sys.getprofile()
+
+    # Processes one item during the session, then blocks on an empty queue
+    # until after the session has been dumped.
+    q = queue.Queue()
+
+    def idle():
+        for item in iter(q.get, None):
+            p.checkpoint()
+            started.set()
+        profile_hooks["idle"] = sys.getprofile()
+
+    threads = [
+        threading.Thread(target=busy, args=("a",)),
+        threading.Thread(target=busy, args=("b",)),
+        threading.Thread(target=idle),
+    ]
+    [t.start() for t in threads]
+
+    session = threading.Thread(target=p.run_session)
+    session.start()
+    while p.session is None or not p.session.active.is_set():
+        pass
+    q.put(1)
+    started.wait()
+    session.join()
+
+    stop.set()
+    q.put(2)
+    q.put(None)
+    [t.join() for t in threads]
+
+    suffixes = sorted(path.name.split(".", 1)[1] for path in tmp_path.iterdir())
+    assert suffixes == ["pstats", "tracemalloc.txt"]
+
+    assert profile_hooks == {"a": None, "b": None, "idle": None}
+    assert p.session is None
+    if profiling_module.PROCESS_WIDE_PROFILER:
+        assert sys.monitoring.get_tool(sys.monitoring.PROFILER_ID) is None
+
+    assert p.sample()["a"]["count"] > 0
+
+
+def make_profiling(tmp_path):
+    p = Profiling()
+    p.enabled = True
+    p.config = {
+        "output_dir": str(tmp_path),
+        "duration_seconds": 0.1,
+        "detach_grace_seconds": 0.0,
+    }
+    return p
+
+
+def test_run_session_keeps_tracemalloc(tmp_path):
+    p = make_profiling(tmp_path)
+    tracemalloc.start()
+    try:
+        p.run_session()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+    assert any(path.name.endswith(".tracemalloc.txt") for path in tmp_path.iterdir())
+
+    p.run_session()
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,118 @@
+import time
+
+import pytest
+
+from nginx_ratelimit_ipset.plugins import plugin_factory
+from nginx_ratelimit_ipset.utils import execute
+
+IPSET_LIST = """Name: offenders
+Type: hash:net
+Revision: 6
+Header: family inet hashsize 1024 maxelem 65536 timeout 3600 counters comment
+Size in memory: 1044
+References: 0
+Number of entries: 0"""
+
+SCHEDULE = [3600, 21600, 86400, 604800]
+
+
+@pytest.fixture
+def commands(monkeypatch):
+    argvs = []
+
+    def simple(argv, **kwargs):
+        argvs.append(argv)
+        if argv[1] == "list":
+            return IPSET_LIST, ""
+        return "", ""
+
+    monkeypatch.setattr(execute, "simple", simple)
+    return argvs
+
+
+def make_sink(**config):
+    sink = plugin_factory("LINUX_IPSET")
+    sink.configure({"ipset_name": "offenders", **config})
+    return sink
+
+
+def add_options(argv):
+    """Return the options of an 'ipset add' command line as a dict."""
+    options = argv[5:]
+    return dict(zip(options[::2], options[1::2]))
+
+
+def expire_ban(sink, addr):
+    """Move the last ban of the address into the past, so it has expired."""
+    count, ts, timeout = sink.history.entries[addr]
+    sink.history.entries[addr] = (count, ts - timeout, timeout)
+
+
+def test_schedule_first_offense(commands):
+    sink = make_sink(entry_timeout_schedule_seconds=SCHEDULE)
+    sink.handle_item({"addr": "10.0.0.1"})
+
+    options = add_options(commands[-1])
+    assert options["timeout"] == "3600"
+    assert "offenses=1" in options["comment"]
+
+
+def test_schedule_nth_offense(commands):
+    sink = make_sink(entry_timeout_schedule_seconds=SCHEDULE)
+    for _ in range(2):
+        sink.handle_item({"addr": "10.0.0.1"})
+        expire_ban(sink, "10.0.0.1")
+    sink.handle_item({"addr": "10.0.0.1"})
+
+    options = add_options(commands[-1])
+    assert options["timeout"] == "86400"
+    assert "offenses=3" in options["comment"]
+
+
+def test_schedule_last_step(commands):
+    sink = make_sink(entry_timeout_schedule_seconds=SCHEDULE)
+    for _ in range(6):
+        sink.handle_item({"addr": "10.0.0.1"})
+        expire_ban(sink, "10.0.0.1")
+    sink.handle_item({"addr": "10.0.0.1"})
+
+    options = add_options(commands[-1])
+    assert options["timeout"] == "604800"
+    assert "offenses=7" in options["comment"]
+
+
+def test_schedule_still_banned(commands):
+    sink = make_sink(entry_timeout_schedule_seconds=SCHEDULE)
+    for _ in range(5):
+        sink.handle_item({"addr": "10.0.0.1"})
+
+    options = add_options(commands[-1])
+    assert options["timeout"] == "3600"
+    assert "offenses=1" in options["comment"]
+
+
+def test_default_timeout(commands):
+    sink = make_sink(entry_default_timeout_seconds=1800)
+    sink.handle_item({"addr": "10.0.0.1"})
+    expire_ban(sink, "10.0.0.1")
+    sink.handle_item({"addr": "10.0.0.1"})
+
+    options = add_options(commands[-1])
+    assert options["timeout"] == "1800"
+    assert "offenses=2" in options["comment"]
+
+
+def test_ipset_default_timeout(commands):
+    sink = make_sink()
+    sink.handle_item({"addr": "10.0.0.1"})
+
+    assert "timeout" not in add_options(commands[-1])
+    assert sink.history.entries["10.0.0.1"][2] == 3600
+    assert sink.history.offenses("10.0.0.1", now=time.time() + 3601) == 2
+
+
+def test_static_comment(commands):
+    sink = make_sink(entry_default_comment="static")
+    sink.handle_item({"addr": "10.0.0.1"})
+
+    assert add_options(commands[-1])["comment"] == "static"
@@ -0,0 +1,114 @@
+from nginx_ratelimit_ipset.plugins import plugin_factory
+
+
+def access_line(addr="10.0.0.1", status=429, path="/api/x", host="a.example"):
+    return (
+        f'{addr} - - [25/Mar/2022:13:00:00 +0000] "GET {path} HTTP/1.1" {status} '
+        f'162 "-" "curl/7.81.0" {host}\n'
+    ).encode("utf-8")
+
+
+def make_source(**config):
+    source = plugin_factory("NGINX_ACCESSLOG_STATUS")
+    source.configure(
+        {
+            "access_log_file_path": "access.log",
+            "log_format": (
+                '$remote_addr - $remote_user [$time_local] "$request" $status '
+                '$body_bytes_sent "$http_referer" "$http_user_agent" $host'
+            ),
+            **config,
+        }
+    )
+    return source
+
+
+def test_filter_lines_status():
+    source = make_source()
+    events = source.filter_lines(
+        [
+            access_line("10.0.0.1", 429),
+            access_line("10.0.0.2", 200),
+            access_line("10.0.0.3", 503),
+            access_line("10.0.0.4", 404),
+        ]
+    )
+
+    assert events == [
+        {"addr": "10.0.0.1", "status": 429, "host": None, "path": None},
+        {"addr": "10.0.0.3", "status": 503, "host": None, "path": None},
+    ]
+
+
+def test_filter_lines_needle_prefilter():
+    source = make_source(statuses=[429])
+
+    # The status value appears in another field only; rejected by the split.
+    assert source.filter_lines([access_line(status=200, path="/ 429 ")]) == []
+
+    # The status value does not appear at all; rejected by the needle scan,
+    # even though the line would not split.
+    assert source.status_needles == [b'" 429 ']
+    assert source.filter_lines([b"garbage\n"]) == []
+
+
+def test_filter_lines_hosts():
+    source = make_source(hosts=["a.example"])
+    events = source.filter_lines(
+        [
+            access_line("10.0.0.1", host="a.example"),
+            access_line("10.0.0.2", host="b.example"),
+        ]
+    )
+
+    assert [(e["addr"], e["host"]) for e in events] == [("10.0.0.1", "a.example")]
+
+
+def test_filter_lines_path_prefixes_from_request():
+    # Without $request_uri or $uri, the path is taken from $request.
+    source = make_source(path_prefixes=["/api/"])
+    events = source.filter_lines(
+        [
+            access_line("10.0.0.1", path="/api/x"),
+            access_line("10.0.0.2", path="/static/x"),
+            access_line("10.0.0.3", path="/api"),
+        ]
+    )
+
+    assert [(e["addr"], e["path"]) for e in events] == [("10.0.0.1", "/api/x")]
+
+
+def test_filter_lines_path_prefixes_from_request_uri():
+    source = make_source(
+        log_format="$remote_addr $status $request_uri",
+        path_prefixes=["/login"],
+    )
+    events = source.filter_lines(
+        [
+            b"10.0.0.1 429 /login?next=/\n",
+            b"10.0.0.2 429 /logout\n",
+        ]
+    )
+
+    assert [(e["addr"], e["path"]) for e in events] == [("10.0.0.1", "/login?next=/")]
+
+
+def test_filter_lines_invalid_addr():
+    source = make_source(
+        log_format='$remote_addr "$http_x_forwarded_for" $status',
+        addr_variable="http_x_forwarded_for",
+    )
+    events = source.filter_lines(
+        [
+            b'unix: "-" 429\n',
+            b'10.0.0.1 "10.0.0.2, 10.0.0.3" 429\n',
+            b'10.0.0.1 "10.0.0.4" 429\n',
+        ]
+    )
+
+    assert [e["addr"] for e in events] == ["10.0.0.4"]
+
+
+def test_filter_lines_ignore_cidrs():
+    source = make_source()
+    assert source.filter_lines([access_line("127.0.0.1")]) == []
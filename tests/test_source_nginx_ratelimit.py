@@ -0,0 +1,136 @@
+import os
+import queue
+import signal
+import threading
+
+import pytest
+
+from nginx_ratelimit_ipset.plugins import plugin_factory
+from nginx_ratelimit_ipset.utils import nginx
+from nginx_ratelimit_ipset.utils.profiling import profiling
+
+LINE = (
+    "2022/03/25 13:00:00 [error] 1#1: *{n} limiting requests, excess: 50.1 by "
+    'zone "{zone}", client: {addr}, server: x, request: "GET / HTTP/1.1"\n'
+)
+
+
+def ratelimit_line(addr, zone="req_zone", n=1):
+    return LINE.format(addr=addr, zone=zone, n=n).encode("utf-8")
+
+
+def start_source(config):
+    source = plugin_factory("NGINX_RATELIMIT")
+    source.configure(
+        {
+            "ratelimit_zone_name": "req_zone",
+            "ratelimit_ignore_if_dry_run": True,
+            "cache_size": 0,
+            **config,
+        }
+    )
+
+    q = queue.Queue(1000)
+    sink_queue = queue.Queue()
+    t = threading.Thread(target=source.qstdout_handler, args=(q, [sink_queue]))
+    t.start()
+
+    return source, q, sink_queue, t
+
+
+def finish_source(q, sink_queue, t):
+    q.put(None)
+
+    # Returns once the None sentinel has been handled.
+    t.join(30.0)
+    assert not t.is_alive()
+
+    return [sink_queue.get_nowait() for _ in range(sink_queue.qsize())]
+
+
+def run_source(config, lines):
+    source, q, sink_queue, t = start_source(config)
+    for line in lines:
+        q.put(line)
+
+    return finish_source(q, sink_queue, t)
+
+
+def lines_and_addrs():
+    lines = []
+    addrs = []
+    for i in range(2000):
+        if i % 7 == 0:
+            addr = f"10.0.{i // 256}.{i % 256}"
+            lines.append(ratelimit_line(addr, n=i))
+            addrs.append(addr)
+        elif i % 7 == 1:
+            lines.append(ratelimit_line("10.1.0.1", zone="other_zone", n=i))
+        elif i % 7 == 2:
+            lines.append(ratelimit_line("127.0.0.1", n=i))
+        else:
+            lines.append(b"2022/03/25 13:00:00 [error] 1#1: *1 open() failed\n")
+
+    return lines, addrs
+
+
+@pytest.mark.parametrize("parse_workers", [0, 2])
+def test_qstdout_handler(parse_workers):
+    lines, addrs = lines_and_addrs()
+    events = run_source(
+        {"parse_workers": parse_workers, "parse_batch_size": 50},
+        lines,
+    )
+
+    assert [e["addr"] for e in events] == addrs
+    assert all(e["type"] is nginx.LimitType.REQUESTS for e in events)
+
+
+def test_qstdout_handler_parallel_bad_line():
+    lines = [
+        ratelimit_line("10.0.0.1"),
+        ratelimit_line("unix:"),
+        ratelimit_line("10.0.0.2"),
+    ]
+    events = run_source(
+        {"parse_workers": 2},
+        lines,
+    )
+
+    assert [e["addr"] for e in events] == ["10.0.0.1", "10.0.0.2"]
+
+
+def test_qstdout_handler_parallel_stages(monkeypatch):
+    monkeypatch.setattr(profiling, "enabled", True)
+    monkeypatch.setattr(profiling, "stages", {})
+
+    lines, _ = lines_and_addrs()
+    run_source(
+        {"parse_workers": 2, "parse_batch_size": 50},
+        lines,
+    )
+
+    # Timed in the workers, merged into this process.
+    assert profiling.sample()["nginx_ratelimit.parse"]["count"] == len(lines)
+
+
+@pytest.mark.parametrize("signum", [signal.SIGKILL, signal.SIGINT])
+def test_qstdout_handler_parallel_worker_killed(signum):
+    lines, addrs = lines_and_addrs()
+    source, q, sink_queue, t = start_source(
+        {"parse_workers": 2, "parse_batch_size": 50}
+    )
+
+    half = len(lines) // 2
+    for line in lines[:half]:
+        q.put(line)
+
+    # Once there is a result, the workers are up.
+    events = [sink_queue.get(timeout=30.0)]
+    os.kill(next(iter(source.parse_pool._processes)), signum)
+
+    for line in lines[half:]:
+        q.put(line)
+
+    events += finish_source(q, sink_queue, t)
+    assert [e["addr"] for e in events] == addrs